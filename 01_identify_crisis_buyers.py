@@ -8,19 +8,20 @@ import os
 from pathlib import Path
 from google.cloud import bigquery
 import pandas as pd
-from datetime import timedelta
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent / "lib"))
 from bigquery_helpers import (
-    get_standard_args, execute_query, load_to_bigquery_table, 
+    get_standard_args, get_client, execute_query, load_to_bigquery_table, 
     create_query_with_udfs, ETHEREUM_CONSTANTS
 )
 
 # Query Configuration
 QUERY_START_DATE = '2021-05-01'
 QUERY_END_DATE = '2023-01-01'
-QUERY_LIMIT = 1000000
+
+# Repeated string columns of the buyer rows held as pandas categoricals
+BUYER_CATEGORY_COLUMNS = ['crisis_id', 'wallet_address', 'token_address']
 
 # BigQuery Schema
 CRISIS_BUYERS_SCHEMA = [
@@ -41,7 +42,7 @@ def identify_crisis_buyers(config):
     
     Returns DataFrame with crisis buyer data ready for BigQuery loading.
     """
-    client = bigquery.Client()
+    client = get_client()
     print("🔍 Starting step-by-step crisis buyer analysis...")
     
     # Step 1: Load crisis events
@@ -50,18 +51,12 @@ def identify_crisis_buyers(config):
     # Step 2: Find DEX pools for crisis tokens  
     pools_df = get_crisis_pools(client, config, crisis_df)
     
-    # Step 3: Query Ethereum swap logs
+    # Step 3: Identify crisis token buyers from Ethereum swap logs within crisis windows
     pool_addresses = list(pools_df['pool_address'].unique())
-    swaps_df = get_ethereum_swaps(client, pool_addresses)
-    
-    # Step 4: Filter swaps within crisis windows
-    crisis_swaps_df = filter_crisis_window_swaps(swaps_df, pools_df)
+    buyers_df = get_crisis_window_buys(client, config, pool_addresses)
     
-    # Step 5: Identify crisis token buyers
-    buyers_df = identify_token_buyers(crisis_swaps_df)
-    
-    # Step 6: Format individual buy records for BigQuery (no aggregation)
-    final_df = format_individual_buys(buyers_df, config)
+    # Step 4: Format individual buy records for BigQuery (no aggregation)
+    final_df = format_individual_buys(buyers_df)
     
     return final_df
 
@@ -89,13 +84,13 @@ def get_crisis_pools(client, config, crisis_df):
     print("Finding crisis pools...")
     
     query = f"""
-    SELECT DISTINCT p.pool_address, p.token0_address, p.token1_address, p.dex_protocol,
-           c.crisis_id, c.token_address AS crisis_token, c.window_start_date, c.window_end_date, c.crisis_name
+    SELECT DISTINCT LOWER(p.pool_address) AS pool_address, LOWER(p.token0_address) AS token0_address,
+           LOWER(p.token1_address) AS token1_address, p.dex_protocol,
+           c.crisis_id, LOWER(c.token_address) AS crisis_token, c.window_start_date, c.window_end_date, c.crisis_name
     FROM `{config.project_id}.{config.dataset_id}.dim_dex_pools` p
     INNER JOIN `{config.project_id}.{config.dataset_id}.crisis_events_with_window` c ON (
       p.token0_address = c.token_address OR p.token1_address = c.token_address
     )
-    ORDER BY c.crisis_id, p.pool_address
     """
     
     df = execute_query(client, query, "crisis pools")
@@ -106,210 +101,142 @@ def get_crisis_pools(client, config, crisis_df):
     return df
 
 
-def get_ethereum_swaps(client, pool_addresses):
-    """Query Ethereum swap logs for relevant pools."""
-    print("Querying Ethereum swap logs...")
+def get_crisis_window_buys(client, config, pool_addresses):
+    """Query priced crisis token buys from Ethereum swap logs, restricted to each crisis buy window.
     
-    pool_addresses_sql = "', '".join(pool_addresses)
-    print(f"  → {len(pool_addresses)} pools, {QUERY_START_DATE} to {QUERY_END_DATE}, limit {QUERY_LIMIT:,}")
+    Window filtering, amount decoding, buy detection and the first-buy price lookup all run
+    in BigQuery, so only confirmed crisis token purchases are downloaded, ready to load.
+    """
+    print("Querying crisis token buys from Ethereum swap logs...")
+    print(f"  → {len(pool_addresses)} pools, {QUERY_START_DATE} to {QUERY_END_DATE}")
     
+    # Each log is joined to the crisis windows of its pool, so only swaps inside
+    # [window_start_date, window_end_date] are considered.
+    # V2 data format: amount0In, amount1In, amount0Out, amount1Out
+    # If crisis token is token0, check amount0Out > 0 (receiving crisis token), else amount1Out
     main_query = f"""
-    SELECT logs.block_timestamp, logs.transaction_hash, logs.log_index,
-           logs.address AS pool_address, logs.topics, logs.data, txns.from_address AS wallet_address
-    FROM `bigquery-public-data.crypto_ethereum.logs` logs
-    LEFT JOIN `bigquery-public-data.crypto_ethereum.transactions` txns ON logs.transaction_hash = txns.hash
-    WHERE logs.topics[SAFE_OFFSET(0)] = '{ETHEREUM_CONSTANTS['V2_SWAP_TOPIC']}'
-      AND logs.block_timestamp >= '{QUERY_START_DATE}' AND logs.block_timestamp <= '{QUERY_END_DATE}'
-      AND logs.address IN ('{pool_addresses_sql}')
-    ORDER BY logs.block_timestamp DESC
-    LIMIT {QUERY_LIMIT}
+    WITH crisis_pool_windows AS (
+      SELECT DISTINCT LOWER(p.pool_address) AS pool_address, p.dex_protocol,
+             LOWER(p.token0_address) = LOWER(c.token_address) AS crisis_is_token0,
+             c.crisis_id, LOWER(c.token_address) AS crisis_token, c.window_start_date, c.window_end_date
+      FROM `{config.project_id}.{config.dataset_id}.dim_dex_pools` p
+      INNER JOIN `{config.project_id}.{config.dataset_id}.crisis_events_with_window` c ON (
+        p.token0_address = c.token_address OR p.token1_address = c.token_address
+      )
+    ),
+    crisis_swaps AS (
+      SELECT c.crisis_id, LOWER(txns.from_address) AS wallet_address, c.crisis_token AS token_address,
+             logs.block_timestamp, c.dex_protocol,
+             DECODE_DATA_AMOUNT(logs.data, IF(c.crisis_is_token0, 66, 130)) AS token_amount
+      FROM `bigquery-public-data.crypto_ethereum.logs` logs
+      INNER JOIN crisis_pool_windows c ON (
+        logs.address = c.pool_address
+        AND DATE(logs.block_timestamp) BETWEEN c.window_start_date AND c.window_end_date
+      )
+      -- Every swap log has its transaction; the date predicate lets BigQuery prune transaction partitions
+      INNER JOIN `bigquery-public-data.crypto_ethereum.transactions` txns ON (
+        logs.transaction_hash = txns.hash
+        AND DATE(txns.block_timestamp) BETWEEN @start_date AND @end_date
+      )
+      WHERE logs.topics[SAFE_OFFSET(0)] = '{ETHEREUM_CONSTANTS['V2_SWAP_TOPIC']}'
+        AND DATE(logs.block_timestamp) BETWEEN @start_date AND @end_date
+        AND logs.address IN UNNEST(@pools)
+    ),
+    buys AS (
+      SELECT crisis_id, wallet_address, token_address, block_timestamp, token_amount
+      FROM crisis_swaps
+      -- Only handle Uniswap V2 - V3 removed for data accuracy
+      WHERE dex_protocol = 'Uniswap V2'
+        AND token_amount > 0
+        AND wallet_address IS NOT NULL
+        AND wallet_address NOT IN ('', '{ETHEREUM_CONSTANTS['ZERO_ADDRESS']}')
+    ),
+    crisis_windows AS (
+      SELECT DISTINCT crisis_id, crisis_token, window_start_date, window_end_date
+      FROM crisis_pool_windows
+      WHERE crisis_id IN (SELECT DISTINCT crisis_id FROM buys)
+    ),
+    -- As-of price join: buys and daily prices (stamped at midnight) share one timeline per
+    -- crisis window, with price rows limited to that window's dates
+    price_timeline AS (
+      SELECT crisis_id, wallet_address, token_address, block_timestamp AS ts, 1 AS is_buy,
+             token_amount, CAST(NULL AS FLOAT64) AS price_usd
+      FROM buys
+      UNION ALL
+      SELECT w.crisis_id, CAST(NULL AS STRING), p.token_address, TIMESTAMP(p.dt), 0,
+             CAST(NULL AS FLOAT64), p.price_usd
+      FROM `{config.project_id}.{config.dataset_id}.dim_token_price_history` p
+      INNER JOIN crisis_windows w ON (
+        p.token_address = w.crisis_token
+        AND p.dt BETWEEN w.window_start_date AND w.window_end_date
+      )
+      WHERE p.dt BETWEEN @start_date AND @end_date
+    ),
+    priced_buys AS (
+      SELECT crisis_id, wallet_address, token_address, ts, is_buy, token_amount,
+             -- Latest price on or before the buy within its crisis window, else the window's next price
+             COALESCE(
+               LAST_VALUE(price_usd IGNORE NULLS) OVER (
+                 PARTITION BY crisis_id, token_address ORDER BY ts, is_buy ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW),
+               FIRST_VALUE(price_usd IGNORE NULLS) OVER (
+                 PARTITION BY crisis_id, token_address ORDER BY ts, is_buy ROWS BETWEEN CURRENT ROW AND UNBOUNDED FOLLOWING),
+               1.0
+             ) AS buy_price
+      FROM price_timeline
+    )
+    -- Rows are returned in the stg_crisis_buyers layout
+    SELECT crisis_id, wallet_address, token_address, ts AS first_buy_timestamp,
+           buy_price AS first_buy_price, token_amount AS total_amount_bought,
+           token_amount * buy_price AS total_usd_spent, 1 AS num_transactions
+    FROM priced_buys
+    WHERE is_buy = 1
     """
     
-    query = create_query_with_udfs(main_query)
-    df = execute_query(client, query, "Ethereum swaps")
-    
-    if len(df) == 0:
-        print("  ⚠️  No swap logs found")
-        return pd.DataFrame()
-    
-    print(f"  → {len(df)} swaps, {df['wallet_address'].nunique()} wallets")
-    return df
-
-
-def filter_crisis_window_swaps(swaps_df, pools_df):
-    """Filter swaps that occurred within crisis buy windows."""
-    print("Filtering swaps within crisis windows...")
-    
-    if len(swaps_df) == 0:
-        return pd.DataFrame()
-    
-    crisis_swaps_data = []
-    
-    for _, pool_row in pools_df.iterrows():
-        pool_swaps = swaps_df[swaps_df['pool_address'] == pool_row['pool_address']]
-        if len(pool_swaps) == 0:
-            continue
-            
-        pool_swaps = pool_swaps.copy()
-        pool_swaps['block_date'] = pd.to_datetime(pool_swaps['block_timestamp']).dt.date
-        
-        window_swaps = pool_swaps[
-            (pool_swaps['block_date'] >= pool_row['window_start_date']) &
-            (pool_swaps['block_date'] <= pool_row['window_end_date'])
-        ]
-        
-        for _, swap_row in window_swaps.iterrows():
-            crisis_swaps_data.append({
-                'crisis_id': pool_row['crisis_id'],
-                'crisis_token': pool_row['crisis_token'],
-                'crisis_name': pool_row['crisis_name'],
-                'token0_address': pool_row['token0_address'],
-                'token1_address': pool_row['token1_address'],
-                'dex_protocol': pool_row['dex_protocol'],
-                'wallet_address': swap_row['wallet_address'],
-                'block_timestamp': swap_row['block_timestamp'],
-                'transaction_hash': swap_row['transaction_hash'],
-                'topics': swap_row['topics'],
-                'data': swap_row['data']
-            })
-    
-    if len(crisis_swaps_data) == 0:
-        print("  ⚠️  No swaps found within crisis windows")
-        return pd.DataFrame()
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter('pools', 'STRING', pool_addresses),
+        bigquery.ScalarQueryParameter('start_date', 'DATE', QUERY_START_DATE),
+        bigquery.ScalarQueryParameter('end_date', 'DATE', QUERY_END_DATE),
+    ])
     
-    df = pd.DataFrame(crisis_swaps_data)
-    print(f"  → {len(df)} swaps in crisis windows, {df['wallet_address'].nunique()} wallets")
-    return df
-
-
-def identify_token_buyers(crisis_swaps_df):
-    """Process swaps to identify crisis token buyers."""
-    print("Processing swaps to identify crisis token purchases...")
-    
-    if len(crisis_swaps_df) == 0:
-        return pd.DataFrame()
+    query = create_query_with_udfs(main_query)
+    # Addresses and ids repeat across many buys; categorical codes keep memory and comparisons cheap
+    buyers_df = execute_query(client, query, "Crisis token buys", job_config,
+                              dtypes={col: 'category' for col in BUYER_CATEGORY_COLUMNS})
     
-    buyers_data = []
-    
-    for _, row in crisis_swaps_df.iterrows():
-        try:
-            is_buy, token_amount = analyze_swap_for_crisis_token(row, ETHEREUM_CONSTANTS['V2_SWAP_TOPIC'])
-            
-            if is_buy and token_amount > 0 and row['wallet_address'] and row['wallet_address'] != ETHEREUM_CONSTANTS['ZERO_ADDRESS']:
-                buyers_data.append({
-                    'crisis_id': row['crisis_id'],
-                    'crisis_name': row['crisis_name'],
-                    'wallet_address': row['wallet_address'],
-                    'token_address': row['crisis_token'],
-                    'block_timestamp': row['block_timestamp'],
-                    'transaction_hash': row['transaction_hash'],
-                    'token_amount': token_amount,
-                    'dex_protocol': row['dex_protocol']
-                })
-        except Exception:
-            continue
-    
-    if len(buyers_data) == 0:
+    if len(buyers_df) == 0:
         print("  ⚠️  No crisis token buyers identified")
         return pd.DataFrame()
     
-    df = pd.DataFrame(buyers_data)
-    print(f"  → {len(df)} purchase transactions, {df['wallet_address'].nunique()} buyers")
-    return df
+    print(f"  → {len(buyers_df)} purchase transactions, {buyers_df['wallet_address'].nunique()} buyers")
+    return buyers_df
 
 
-def format_individual_buys(buyers_df, config):
+def format_individual_buys(buyers_df):
     """Format individual buy records for BigQuery."""
     print("Formatting individual buy records...")
     
     if len(buyers_df) == 0:
         return pd.DataFrame()
     
-    # Rename columns and add required fields
-    final_df = buyers_df.rename(columns={
-        'block_timestamp': 'first_buy_timestamp',
-        'token_amount': 'total_amount_bought'
-    })
-    final_df['num_transactions'] = 1
-    
-    # Remove unnecessary columns
-    columns_to_drop = ['crisis_name', 'dex_protocol', 'transaction_hash']
-    final_df = final_df.drop(columns=[col for col in columns_to_drop if col in final_df.columns])
-    
-    # Calculate prices and format for BigQuery
-    final_df = calculate_price_and_usd_spent(final_df, config)
-    final_df = format_for_bigquery_schema(final_df)
+    # Prices and USD totals come from the buys query; only schema formatting remains
+    final_df = format_for_bigquery_schema(buyers_df)
     final_df = final_df.sort_values(['crisis_id', 'first_buy_timestamp'], ascending=[True, False])
     
     print(f"  → {len(final_df)} buy transactions, {final_df['wallet_address'].nunique()} wallets")
     return final_df
 
 
-def calculate_price_and_usd_spent(df, config):
-    """Calculate first_buy_price and total_usd_spent by joining with price history."""
-    if len(df) == 0:
-        return df
-    
-    try:
-        client = bigquery.Client()
-        unique_tokens = df['token_address'].unique()
-        tokens_sql = "', '".join(unique_tokens)
-        min_date = df['first_buy_timestamp'].min().date()
-        max_date = df['first_buy_timestamp'].max().date()
-        
-        price_query = f"""
-        SELECT token_address, dt as price_date, price_usd
-        FROM `{config.project_id}.{config.dataset_id}.dim_token_price_history`
-        WHERE token_address IN ('{tokens_sql}') AND dt BETWEEN '{min_date}' AND '{max_date}'
-        ORDER BY token_address, dt
-        """
-        
-        price_df = execute_query(client, price_query, "price history")
-        
-        if len(price_df) == 0:
-            df['first_buy_price'] = 1.0
-            df['total_usd_spent'] = df['total_amount_bought'] * 1.0
-            return df
-        
-        # Convert dates and calculate prices
-        df['buy_date'] = pd.to_datetime(df['first_buy_timestamp']).dt.date
-        price_df['price_date'] = pd.to_datetime(price_df['price_date']).dt.date
-        
-        df_with_prices = []
-        for _, row in df.iterrows():
-            token_prices = price_df[price_df['token_address'] == row['token_address']]
-            
-            if len(token_prices) == 0:
-                price = 1.0
-            else:
-                suitable_prices = token_prices[token_prices['price_date'] <= row['buy_date']]
-                price = suitable_prices.iloc[-1]['price_usd'] if len(suitable_prices) > 0 else token_prices.iloc[0]['price_usd']
-            
-            row_dict = row.to_dict()
-            row_dict['first_buy_price'] = price
-            row_dict['total_usd_spent'] = row['total_amount_bought'] * price
-            df_with_prices.append(row_dict)
-        
-        result_df = pd.DataFrame(df_with_prices).drop(columns=['buy_date'])
-        print("  → Prices calculated")
-        return result_df
-        
-    except Exception as e:
-        print(f"  ⚠️  Price calculation failed: {e}")
-        df['first_buy_price'] = 1.0
-        df['total_usd_spent'] = df['total_amount_bought'] * 1.0
-        return df
-
-
 def format_for_bigquery_schema(df):
     """Format DataFrame to match stg_crisis_buyers BigQuery schema."""
     if len(df) == 0:
         return df
     
-    # Convert data types
+    # Convert data types, collecting invalid ids/addresses into one mask applied below
+    keep = pd.Series(True, index=df.index)
     for field in ['crisis_id', 'wallet_address', 'token_address']:
+        keep &= df[field].notna()
         df[field] = df[field].astype(str)
-        df = df[df[field].notna() & (df[field] != '') & (df[field] != 'nan')]
+        keep &= (df[field] != '') & (df[field] != 'nan')
     
     df['first_buy_timestamp'] = pd.to_datetime(df['first_buy_timestamp'])
     
@@ -318,66 +245,14 @@ def format_for_bigquery_schema(df):
     
     df['num_transactions'] = pd.to_numeric(df['num_transactions'], errors='coerce').astype('Int64')
     
-    # Reorder columns and filter nulls
+    # Reorder columns and filter invalid rows in a single pass
     column_order = ['crisis_id', 'wallet_address', 'token_address', 'first_buy_timestamp',
                    'first_buy_price', 'total_amount_bought', 'total_usd_spent', 'num_transactions']
-    df = df[column_order]
+    keep &= df['first_buy_timestamp'].notna()
     
-    for field in ['crisis_id', 'wallet_address', 'token_address', 'first_buy_timestamp']:
-        df = df[df[field].notna()]
-    
-    return df
-
-
+    return df.loc[keep, column_order]
 
 
-def analyze_swap_for_crisis_token(swap_row, v2_topic):
-    """
-    Analyze a Uniswap V2 swap transaction to determine if it's buying the crisis token.
-    
-    Returns (is_buy: bool, token_amount: float)
-    """
-    try:
-        crisis_token = swap_row['crisis_token'].lower()
-        token0 = swap_row['token0_address'].lower()
-        token1 = swap_row['token1_address'].lower()
-        dex_protocol = swap_row['dex_protocol']
-        data = swap_row['data']
-        
-        if not data or len(data) < 10:
-            return False, 0.0
-        
-        # Only handle Uniswap V2 - V3 removed for data accuracy
-        if dex_protocol == 'Uniswap V2':
-            # V2 data format: amount0In, amount1In, amount0Out, amount1Out
-            # If crisis token is token0, check amount0Out > 0 (receiving crisis token)
-            if token0 == crisis_token:
-                try:
-                    # Extract amount0Out (bytes 65-96 of data, accounting for 0x prefix)
-                    amount_hex = data[66:130] if len(data) >= 130 else '0'
-                    amount = int(amount_hex, 16) if amount_hex else 0
-                    if amount > 0:
-                        return True, float(amount) / 1e18
-                except:
-                    pass
-                    
-            # If crisis token is token1, check amount1Out > 0
-            elif token1 == crisis_token:
-                try:
-                    # Extract amount1Out (bytes 97-128 of data)
-                    amount_hex = data[130:194] if len(data) >= 194 else '0'
-                    amount = int(amount_hex, 16) if amount_hex else 0
-                    if amount > 0:
-                        return True, float(amount) / 1e18
-                except:
-                    pass
-        
-        return False, 0.0
-        
-    except Exception as e:
-        print(f"    Error analyzing swap: {e}")
-        return False, 0.0
-
 
 
 def validate_crisis_buyers_data(df):
@@ -437,16 +312,16 @@ def show_sample_records(df):
     sample_size = min(10, len(df))
     sample_df = df.head(sample_size)
     
-    for i, (_, row) in enumerate(sample_df.iterrows(), 1):
+    for i, row in enumerate(sample_df.itertuples(index=False), 1):
         print(f"\nRecord {i}:")
-        print(f"  Crisis ID: {row['crisis_id']}")
-        print(f"  Wallet: {row['wallet_address']}")
-        print(f"  Token: {row['token_address']}")
-        print(f"  Buy Time: {row['first_buy_timestamp']}")
-        print(f"  Amount Bought: {row['total_amount_bought']:.6f} tokens")
-        print(f"  Price per Token: ${row['first_buy_price']:.6f}")
-        print(f"  Total USD Spent: ${row['total_usd_spent']:.2f}")
-        print(f"  Transactions: {row['num_transactions']}")
+        print(f"  Crisis ID: {row.crisis_id}")
+        print(f"  Wallet: {row.wallet_address}")
+        print(f"  Token: {row.token_address}")
+        print(f"  Buy Time: {row.first_buy_timestamp}")
+        print(f"  Amount Bought: {row.total_amount_bought:.6f} tokens")
+        print(f"  Price per Token: ${row.first_buy_price:.6f}")
+        print(f"  Total USD Spent: ${row.total_usd_spent:.2f}")
+        print(f"  Transactions: {row.num_transactions}")
         
     if len(df) > 10:
         print(f"\n... and {len(df) - 10} more records")
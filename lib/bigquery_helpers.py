@@ -2,20 +2,39 @@
 BigQuery helper functions for Phoenix Flipper project.
 Provides utilities for loading UDFs, common query patterns, and data loading.
 """
+import io
 import os
+import time
 import argparse
 from pathlib import Path
 from collections import namedtuple
-from google.cloud import bigquery
-import pandas as pd
+from functools import lru_cache
 
 
 # Configuration
 BigQueryConfig = namedtuple('BigQueryConfig', ['project_id', 'dataset_id'])
 
+# BigQuery, pyarrow and pandas are imported inside the functions that use them, so
+# argument parsing (and the prep orchestrator, which runs before dependencies are
+# installed) does not pay for, or depend on, those imports.
 
+# Parquet upload settings
+PARQUET_ROW_GROUP_SIZE = 100_000
+LOAD_CHUNK_SIZE = 500_000
+STAGING_TABLE_SUFFIX = '__staging'
+
+# Above this many rows, non-dry-run loads validate a leading sample instead of the whole frame
+FULL_VALIDATION_MAX_ROWS = 1_000_000
+VALIDATION_SAMPLE_ROWS = 10_000
+
+# Job polling: start fast so small jobs return quickly, back off for long ones
+JOB_POLL_INITIAL_SECONDS = 0.1
+JOB_POLL_MAX_SECONDS = 2.0
+
+
+@lru_cache(maxsize=1)
 def load_ethereum_udfs():
-    """Load Ethereum UDF definitions from lib/ethereum_udfs.sql"""
+    """Load Ethereum UDF definitions from lib/ethereum_udfs.sql (read once per process)"""
     lib_dir = Path(__file__).parent
     udf_file = lib_dir / "ethereum_udfs.sql"
     
@@ -29,8 +48,11 @@ def create_query_with_udfs(query_sql):
     return f"{udfs}\n\n{query_sql}"
 
 
-def get_standard_args(description):
-    """Parse standard command line arguments for Phoenix Flipper scripts."""
+def get_standard_args(description, argv=None):
+    """Parse standard command line arguments for Phoenix Flipper scripts.
+    
+    argv defaults to sys.argv[1:]; pass a list to parse arguments without touching sys.argv.
+    """
     parser = argparse.ArgumentParser(description=description)
     
     project_id = os.environ.get('PROJECT_ID', '')
@@ -46,7 +68,7 @@ def get_standard_args(description):
                        action='store_true',
                        help='Run analysis without writing results to BigQuery')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     if '.' not in args.target:
         raise ValueError("Target must be in format PROJECT_ID.DATASET_ID")
@@ -55,18 +77,66 @@ def get_standard_args(description):
     return BigQueryConfig(project_id=project_id, dataset_id=dataset_id), args.dry_run
 
 
-def execute_query(client, query, description="query"):
-    """Execute a BigQuery query with error handling."""
+@lru_cache(maxsize=4)
+def get_client(project_id=None):
+    """Shared BigQuery client per project, so credentials and connections are set up once"""
+    from google.cloud import bigquery
+    return bigquery.Client(project=project_id)
+
+
+@lru_cache(maxsize=1)
+def get_bqstorage_client():
+    """Shared BigQuery Storage read client, or None if google-cloud-bigquery-storage is not installed"""
     try:
-        query_job = client.query(query)
-        df = query_job.to_dataframe()
+        from google.cloud import bigquery_storage
+    except ImportError:
+        return None
+    return bigquery_storage.BigQueryReadClient()
+
+
+def execute_query(client, query, description="query", job_config=None, dtypes=None):
+    """Execute a BigQuery query with error handling.
+    
+    Results are downloaded through the BigQuery Storage API (Arrow streams) using one
+    read client shared across queries; without google-cloud-bigquery-storage the client
+    falls back to REST. Optional dtypes ({column: dtype}) are applied while the DataFrame is built.
+    """
+    try:
+        query_job = client.query(query, job_config=job_config)
+        df = query_job.to_dataframe(bqstorage_client=get_bqstorage_client(), create_bqstorage_client=True,
+                                    dtypes=dtypes)
         return df
     except Exception as e:
         raise Exception(f"{description} failed: {e}")
 
 
-def load_to_bigquery_table(df, config, table_name, schema, dry_run=False, validator_func=None, sample_func=None):
-    """Generic function to load DataFrame to BigQuery table."""
+def wait_for_job(job, timeout=None):
+    """Poll a BigQuery job with exponential backoff until it finishes, then return its result.
+    
+    Waits indefinitely by default. With a timeout (seconds), the job is cancelled before
+    TimeoutError is raised, so it cannot complete (and write) after the caller gave up.
+    """
+    delay = JOB_POLL_INITIAL_SECONDS
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while not job.done():
+        if deadline is not None and time.monotonic() > deadline:
+            job.cancel()
+            raise TimeoutError(f"BigQuery job {job.job_id} did not finish within {timeout}s and was cancelled")
+        time.sleep(delay)
+        delay = min(delay * 2, JOB_POLL_MAX_SECONDS)
+    return job.result()
+
+
+def load_to_bigquery_table(df, config, table_name, schema, dry_run=False, validator_func=None, sample_func=None,
+                           chunk_size=LOAD_CHUNK_SIZE, client=None, full_validate=False):
+    """Generic function to load DataFrame to BigQuery table.
+    
+    DataFrames up to chunk_size rows are a single WRITE_TRUNCATE load job. Larger ones are
+    uploaded in chunks to a staging table and then swapped into the target in one
+    transaction, so a failed chunk never leaves the target truncated or partially loaded. On loads above
+    FULL_VALIDATION_MAX_ROWS the validator only sees the first VALIDATION_SAMPLE_ROWS
+    rows unless full_validate is set (dry runs always validate everything).
+    """
     if len(df) == 0:
         print("⚠️  No data to load")
         return
@@ -75,7 +145,11 @@ def load_to_bigquery_table(df, config, table_name, schema, dry_run=False, valida
     
     # Run validation if provided
     if validator_func:
-        validator_func(df)
+        if len(df) > FULL_VALIDATION_MAX_ROWS and not (dry_run or full_validate):
+            print(f"ℹ️  Large load: validating the first {VALIDATION_SAMPLE_ROWS} of {len(df)} records")
+            validator_func(df.head(VALIDATION_SAMPLE_ROWS))
+        else:
+            validator_func(df)
     
     # Show sample if provided
     if sample_func:
@@ -85,16 +159,32 @@ def load_to_bigquery_table(df, config, table_name, schema, dry_run=False, valida
         print(f"🔍 DRY RUN: Would load {len(df)} records to {table_name}")
         return
     
-    client = bigquery.Client()
-    job_config = bigquery.LoadJobConfig(
-        schema=schema,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
-    )
+    client = client or get_client(config.project_id)
+    # Without an explicit schema, load with the destination's own schema so WRITE_TRUNCATE
+    # keeps its DDL (NOT NULL modes, descriptions) instead of replacing it with inferred types
+    if schema is None:
+        schema = get_table_schema(client, table_id)
     
     try:
         print(f"📤 Loading {len(df)} records to {table_name}...")
-        job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
-        job.result()
+        if len(df) <= chunk_size:
+            load_parquet_chunks(client, df, table_id, schema, chunk_size)
+        else:
+            staging_id = f"{table_id}{STAGING_TABLE_SUFFIX}"
+            try:
+                load_parquet_chunks(client, df, staging_id, schema, chunk_size)
+                columns = ', '.join(f"`{name}`" for name in (
+                    [field.name for field in schema] if schema else df.columns
+                ))
+                wait_for_job(client.query(f"""
+                CREATE TABLE IF NOT EXISTS `{table_id}` LIKE `{staging_id}`;
+                BEGIN TRANSACTION;
+                DELETE FROM `{table_id}` WHERE TRUE;
+                INSERT INTO `{table_id}` ({columns}) SELECT {columns} FROM `{staging_id}`;
+                COMMIT TRANSACTION;
+                """))
+            finally:
+                client.delete_table(staging_id, not_found_ok=True)
         print("✅ Data loaded successfully")
         
     except Exception as e:
@@ -102,6 +192,75 @@ def load_to_bigquery_table(df, config, table_name, schema, dry_run=False, valida
         raise
 
 
+def get_table_schema(client, table_id):
+    """Schema of an existing BigQuery table, or None if the table does not exist yet"""
+    from google.api_core.exceptions import NotFound
+    try:
+        return client.get_table(table_id).schema
+    except NotFound:
+        return None
+
+
+def load_parquet_chunks(client, df, table_id, schema, chunk_size=LOAD_CHUNK_SIZE):
+    """Load a DataFrame as Parquet load jobs of up to chunk_size rows (first truncates, rest append)."""
+    from google.cloud import bigquery
+    
+    for start in range(0, len(df), chunk_size):
+        job_config = bigquery.LoadJobConfig(
+            schema=schema,
+            write_disposition=(bigquery.WriteDisposition.WRITE_TRUNCATE if start == 0
+                               else bigquery.WriteDisposition.WRITE_APPEND),
+            source_format=bigquery.SourceFormat.PARQUET
+        )
+        parquet_buffer = dataframe_to_parquet(df.iloc[start:start + chunk_size], schema)
+        job = client.load_table_from_file(parquet_buffer, table_id, job_config=job_config)
+        wait_for_job(job)
+
+
+@lru_cache(maxsize=1)
+def get_bq_to_arrow_types():
+    """BigQuery -> Arrow type mapping for explicit load schemas"""
+    import pyarrow as pa
+    return {
+        'STRING': pa.string(),
+        'FLOAT64': pa.float64(),
+        'FLOAT': pa.float64(),
+        'INT64': pa.int64(),
+        'INTEGER': pa.int64(),
+        'BOOL': pa.bool_(),
+        'BOOLEAN': pa.bool_(),
+        'DATE': pa.date32(),
+        'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+    }
+
+
+def dataframe_to_parquet(df, schema=None):
+    """Serialize a DataFrame to an in-memory Parquet file for a BigQuery load job.
+    
+    With a schema, columns are converted straight to the matching Arrow types so the
+    upload matches the table without client-side inference; otherwise types are inferred.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    if schema:
+        arrow_types = get_bq_to_arrow_types()
+        arrow_schema = pa.schema([
+            pa.field(field.name, arrow_types[field.field_type], nullable=field.mode != 'REQUIRED')
+            for field in schema
+        ])
+        table = pa.Table.from_pandas(df[arrow_schema.names], schema=arrow_schema, preserve_index=False)
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    
+    buffer = io.BytesIO()
+    # BigQuery timestamps have microsecond precision
+    pq.write_table(table, buffer, row_group_size=PARQUET_ROW_GROUP_SIZE, compression='snappy',
+                   coerce_timestamps='us', allow_truncated_timestamps=True)
+    buffer.seek(0)
+    return buffer
+
+
 # Common constants for Ethereum analysis
 ETHEREUM_CONSTANTS = {
     'UNISWAP_V2_FACTORY': '0x5c69bee701ef814a2b6a3edd4b1652cb9cc5aa6f',
@@ -39,3 +39,19 @@ AS (
     ELSE 'Unknown'
   END
 );
+
+-- Decode a 32-byte amount word from a log data field, scaled to 18 decimals
+-- The word starts at 0-based character offset char_offset (after '0x'); missing words decode as 0
+-- Usage: DECODE_DATA_AMOUNT(data, 66) for the word at data[66:130]
+CREATE TEMP FUNCTION DECODE_DATA_AMOUNT(data STRING, char_offset INT64)
+RETURNS FLOAT64
+AS (
+  IF(
+    LENGTH(IFNULL(data, '')) >= char_offset + 64,
+    (
+      SELECT SUM(CAST(CONCAT('0x', SUBSTR(data, char_offset + 1 + limb * 8, 8)) AS INT64) * POW(2.0, 32 * (7 - limb)))
+      FROM UNNEST(GENERATE_ARRAY(0, 7)) AS limb
+    ) / 1e18,
+    0
+  )
+);
@@ -4,17 +4,27 @@ Phoenix Flipper Pipeline Orchestrator
 Runs the complete data pipeline from schema creation to mock data generation.
 """
 import argparse
+import hashlib
+import importlib
 import subprocess
 import sys
+import sysconfig
+import threading
 import os
+import runpy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / 'lib'))
+import bigquery_helpers
 from bigquery_helpers import get_standard_args, BigQueryConfig
 
 # Configuration constants
 CRISES = 12
+OUTPUT_TAIL_LINES = 200
+REQUIREMENTS_HASH_FILE = Path.home() / '.cache' / 'phoenix_flipper' / 'req_hash'
 
 
 def get_args():
@@ -32,6 +42,9 @@ Examples:
 
   # Data-only mode - skip setup steps
   python prep/00_run_prep.py --target my-project.phoenix_flipper --data-only
+
+  # Pause for review after each step
+  python prep/00_run_prep.py --target my-project.phoenix_flipper --interactive
         """
     )
     
@@ -41,10 +54,13 @@ Examples:
     default_target = f"{project_id}.{dataset_id}" if project_id and dataset_id else ""
     
     parser.add_argument('--target', 
-                       required=not bool(default_target),
                        default=default_target,
                        help='Target in format PROJECT_ID.DATASET_ID')
     
+    # Older invocations passed the project and dataset separately
+    parser.add_argument('--project', help='Project ID (alternative to --target, used with --dataset)')
+    parser.add_argument('--dataset', help='Dataset ID (alternative to --target, used with --project)')
+    
     parser.add_argument(
         '--hard-reset', 
         action='store_true',
@@ -57,10 +73,17 @@ Examples:
         help='Skip BigQuery connection test'
     )
     
+    parser.add_argument(
+        '--interactive', 
+        action='store_true',
+        help='Pause for review after each step (ignored when stdin is not a terminal)'
+    )
+    
+    # Non-interactive is now the default; --no-prompt is kept so existing invocations still work
     parser.add_argument(
         '--no-prompt', 
         action='store_true',
-        help='Skip interactive prompts between steps (run non-interactively)'
+        help=argparse.SUPPRESS
     )
     
     parser.add_argument(
@@ -71,37 +94,167 @@ Examples:
     
     args = parser.parse_args()
     
+    if args.project and args.dataset:
+        args.target = f"{args.project}.{args.dataset}"
+    elif args.project or args.dataset:
+        parser.error("--project and --dataset must be given together")
+    if not args.target:
+        parser.error("--target (or --project and --dataset) is required")
+    
     if '.' not in args.target:
         raise ValueError("Target must be in format PROJECT_ID.DATASET_ID")
     
     return args
 
 
-def run_command(cmd, description, prompt_after=True, env=None):
-    """Run a command and handle errors."""
+def run_command(cmd, description, prompt_after=False, env=None):
+    """Run a command, streaming its output as it runs, and handle errors."""
     print(f"\n🚀 {description}")
     
+    # Unbuffered child output so progress lines show up as they are printed
+    env = dict(env if env is not None else os.environ, PYTHONUNBUFFERED='1')
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, env=env)
+    for line in proc.stdout:
+        sys.stdout.write(line)
+        tail.append(line)
+    proc.wait()
+    
+    if proc.returncode != 0:
+        print(f"❌ {description} failed with exit code {proc.returncode}")
+        print(f"Last {len(tail)} lines of output:")
+        print("".join(tail), end="")
+        return False
+    
+    print(f"✅ {description} completed successfully")
+    
+    # Interactive prompt after successful completion
+    if prompt_after:
+        prompt_to_continue()
+    
+    return True
+
+
+def run_script(script, script_args, description, prompt_after=False):
+    """Run a prep script's __main__ inside this interpreter and handle errors.
+    
+    Avoids a fresh Python start-up and re-importing BigQuery/pandas for each step; the
+    scripts still parse their own arguments, so they are handed a patched sys.argv.
+    sys.argv, sys.path and the helpers' cached clients/UDFs are reset after every step
+    so no state carries over into the next one.
+    """
+    print(f"\n🚀 {description}")
+    
+    saved_argv = sys.argv
+    saved_path = list(sys.path)
+    sys.argv = [str(script), *script_args]
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True, env=env)
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
-        print(f"✅ {description} completed successfully")
-        
-        # Interactive prompt after successful completion
-        if prompt_after:
-            print(f"\n{'='*60}")
-            print("📋 Step completed! Review the output above.")
-            input("Press Enter to continue to the next step... ")
-        
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {description} failed with exit code {e.returncode}")
-        print("STDOUT:", e.stdout)
-        print("STDERR:", e.stderr)
+        runpy.run_path(str(script), run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            print(f"❌ {description} failed with exit code {e.code}")
+            return False
+    except Exception as e:
+        print(f"❌ {description} failed: {e}")
         return False
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        reset_helper_caches()
+    
+    print(f"✅ {description} completed successfully")
+    
+    # Interactive prompt after successful completion
+    if prompt_after:
+        prompt_to_continue()
+    
+    return True
 
 
+def reset_helper_caches():
+    """Drop the BigQuery clients and UDF text cached in bigquery_helpers by an in-process step."""
+    bigquery_helpers.get_client.cache_clear()
+    bigquery_helpers.get_bqstorage_client.cache_clear()
+    bigquery_helpers.load_ethereum_udfs.cache_clear()
+
+
+def prompt_to_continue():
+    """Pause until the operator has reviewed the step output."""
+    print(f"\n{'='*60}")
+    print("📋 Step completed! Review the output above.")
+    input("Press Enter to continue to the next step... ")
+
+
+def requirements_fingerprint(requirements_file):
+    """Hash requirements.txt, the interpreter path and the site-packages mtimes.
+    
+    A new venv changes the interpreter path; installing or removing packages by hand
+    changes the site-packages directory mtime, so either one triggers a reinstall.
+    """
+    digest = hashlib.sha256(requirements_file.read_bytes())
+    digest.update(sys.executable.encode())
+    paths = sysconfig.get_paths()
+    for site_dir in sorted({paths['purelib'], paths['platlib']}):
+        try:
+            digest.update(str(os.stat(site_dir).st_mtime_ns).encode())
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+
+def run_commands_parallel(steps, env=None):
+    """Run independent (cmd, description) steps concurrently and handle errors.
+    
+    Each step's output is streamed as it runs, prefixed with its step label (the part of
+    the description before the colon), and its tail is printed again if it fails.
+    Interactive prompts are skipped while steps run side by side; if any step fails
+    (or cannot be started at all), the ones still running are terminated.
+    """
+    # Unbuffered child output so progress lines show up as they are printed
+    env = dict(env if env is not None else os.environ, PYTHONUNBUFFERED='1')
+    procs = []
+    print_lock = threading.Lock()
+    
+    def run_step(cmd, description):
+        label = description.split(':', 1)[0]
+        tail = deque(maxlen=OUTPUT_TAIL_LINES)
+        print(f"\n🚀 {description}")
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, env=env)
+        except OSError as e:
+            with print_lock:
+                print(f"❌ {description} failed to start: {e}")
+            return None, tail
+        procs.append(proc)
+        for line in proc.stdout:
+            with print_lock:
+                sys.stdout.write(f"[{label}] {line}")
+            tail.append(line)
+        proc.wait()
+        return proc.returncode, tail
+    
+    success = True
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = {executor.submit(run_step, cmd, description): description for cmd, description in steps}
+        for future in as_completed(futures):
+            description = futures[future]
+            returncode, tail = future.result()
+            if returncode == 0:
+                print(f"✅ {description} completed successfully")
+            else:
+                # returncode is None when the step never started (already reported)
+                if returncode is not None:
+                    with print_lock:
+                        print(f"❌ {description} failed with exit code {returncode}")
+                        print(f"Last {len(tail)} lines of output:")
+                        print("".join(tail), end="")
+                success = False
+                for proc in procs:
+                    if proc.poll() is None:
+                        proc.terminate()
+    
+    return success
 
 
 def main():
@@ -117,27 +270,37 @@ def main():
     env['DATASET_ID'] = dataset_id
     
     print("🏷️  Phoenix Flipper Data Pipeline")
-    print(f"Target: {args.target} | Reset: {'YES' if args.hard_reset else 'NO'} | Interactive: {'OFF' if args.no_prompt else 'ON'}")
+    interactive = args.interactive and not args.no_prompt and sys.stdin.isatty()
+    print(f"Target: {args.target} | Reset: {'YES' if args.hard_reset else 'NO'} | Interactive: {'ON' if interactive else 'OFF'}")
     
     # Get the directory where this script is located
     script_dir = Path(__file__).parent
     
     success = True
-    interactive = not args.no_prompt
     
     # Skip setup steps if data-only mode is enabled
     if not args.data_only:
-        # Step 0: Install Python dependencies
-        cmd = [sys.executable, "-m", "pip", "install", "-r", str(script_dir / "requirements.txt")]
-        success &= run_command(cmd, "Step 0: Installing Python Dependencies", interactive, env)
-        if not success:
-            print("❌ Pipeline failed at dependency installation")
-            sys.exit(1)
+        # Step 0: Install Python dependencies (skipped when requirements.txt is unchanged)
+        requirements_file = script_dir / "requirements.txt"
+        requirements_hash = requirements_fingerprint(requirements_file)
+        if REQUIREMENTS_HASH_FILE.exists() and REQUIREMENTS_HASH_FILE.read_text() == requirements_hash:
+            print("\n⏭️  Dependencies unchanged, skipping installation")
+        else:
+            cmd = [sys.executable, "-m", "pip", "install", "-r", str(requirements_file)]
+            success &= run_command(cmd, "Step 0: Installing Python Dependencies", interactive, env)
+            if not success:
+                print("❌ Pipeline failed at dependency installation")
+                sys.exit(1)
+            # Fingerprint again: the install itself touches site-packages
+            REQUIREMENTS_HASH_FILE.parent.mkdir(parents=True, exist_ok=True)
+            REQUIREMENTS_HASH_FILE.write_text(requirements_fingerprint(requirements_file))
+            # Make packages installed just now importable by the in-process steps
+            importlib.invalidate_caches()
         
         # Step 1: Test BigQuery connection (optional)
         if not args.skip_test:
-            cmd = [sys.executable, str(script_dir / "01_test_bq.py"), "--target", args.target]
-            success &= run_command(cmd, "Step 1: Testing BigQuery Connection", interactive, env)
+            success &= run_script(script_dir / "01_test_bq.py", ["--target", args.target],
+                                  "Step 1: Testing BigQuery Connection", interactive)
             if not success:
                 print("❌ Pipeline failed at BigQuery connection test")
                 sys.exit(1)
@@ -146,65 +309,45 @@ def main():
     else:
         print("\n🚀 DATA-ONLY MODE: Skipping setup steps, going straight to schema creation and data generation")
     
+    # Steps 1-3 and 6 run in this interpreter; 4 and 5 run as concurrent child processes
     # Step 2: Create schemas
-    cmd = [
-        sys.executable, 
-        str(script_dir / "02_create_schemas.py"), 
-        "--target", args.target
-    ]
+    script_args = ["--target", args.target]
     if args.hard_reset or args.data_only:
-        cmd.append("--drop")
+        script_args.append("--drop")
     
-    success &= run_command(cmd, "Step 2: Creating BigQuery Schemas", interactive, env)
+    success &= run_script(script_dir / "02_create_schemas.py", script_args, "Step 2: Creating BigQuery Schemas", interactive)
     if not success:
         print("❌ Pipeline failed at schema creation")
         sys.exit(1)
     
     # Step 3: Generate crisis events first
-    cmd = [
-        sys.executable, 
-        str(script_dir / "03_generate_crisis_data.py"), 
-        "--target", args.target,
-        "--count", str(CRISES)
-    ]
+    script_args = ["--target", args.target, "--count", str(CRISES)]
     
-    success &= run_command(cmd, "Step 3: Generating Crisis Events Data", interactive, env)
+    success &= run_script(script_dir / "03_generate_crisis_data.py", script_args,
+                          "Step 3: Generating Crisis Events Data", interactive)
     if not success:
         print("❌ Pipeline failed at crisis data generation")
         sys.exit(1)
     
-    # Step 4: Generate price history data
-    cmd = [
-        sys.executable, 
-        str(script_dir / "04_generate_price_history.py"), 
-        "--target", args.target
+    # Steps 4 and 5 both read crisis_events_with_window but not each other, so run them side by side
+    steps = [
+        ([sys.executable, str(script_dir / "04_generate_price_history.py"), "--target", args.target],
+         "Step 4: Generating Price History Data"),
+        ([sys.executable, str(script_dir / "05_generate_dex_pools.py"), "--target", args.target],
+         "Step 5: Generating DEX Pools Data"),
     ]
     
-    success &= run_command(cmd, "Step 4: Generating Price History Data", interactive, env)
+    success &= run_commands_parallel(steps, env)
     if not success:
-        print("❌ Pipeline failed at price history generation")
+        print("❌ Pipeline failed at price history / DEX pools generation")
         sys.exit(1)
     
-    # Step 5: Generate DEX pools data
-    cmd = [
-        sys.executable, 
-        str(script_dir / "05_generate_dex_pools.py"), 
-        "--target", args.target
-    ]
-    
-    success &= run_command(cmd, "Step 5: Generating DEX Pools Data", interactive, env)
-    if not success:
-        print("❌ Pipeline failed at DEX pools generation")
-        sys.exit(1)
+    if interactive:
+        prompt_to_continue()
     
     # Step 6: Verify data quality
-    cmd = [
-        sys.executable, 
-        str(script_dir / "06_verify_data_quality.py"), 
-        "--target", args.target
-    ]
-    
-    success &= run_command(cmd, "Step 6: Verifying Data Quality", interactive, env)
+    success &= run_script(script_dir / "06_verify_data_quality.py", ["--target", args.target],
+                          "Step 6: Verifying Data Quality", interactive)
     if not success:
         print("❌ Pipeline failed at data quality verification")
         sys.exit(1)
@@ -4,30 +4,34 @@ Test BigQuery connection and basic functionality.
 """
 import os
 import sys
+from itertools import islice
 from pathlib import Path
-from google.cloud import bigquery
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / "lib"))
-from bigquery_helpers import get_standard_args, execute_query
+from bigquery_helpers import get_standard_args, get_client, execute_query
+
+# Datasets listed by the connection test
+DATASETS_SHOWN = 5
+
 
 def test_connection(config):
     """Test BigQuery connection."""
     try:
-        client = bigquery.Client(project=config.project_id)
+        client = get_client(config.project_id)
         print("✓ BigQuery client initialized successfully")
         print(f"✓ Using project: {config.project_id}")
         
-        # List datasets to verify connection
-        datasets = list(client.list_datasets())
-        print(f"✓ Connection successful. Found {len(datasets)} datasets.")
+        # List datasets to verify connection (one extra entry tells us whether there are more)
+        datasets = list(islice(client.list_datasets(page_size=DATASETS_SHOWN + 1), DATASETS_SHOWN + 1))
+        print("✓ Connection successful.")
         
         if datasets:
             print("Available datasets:")
-            for dataset in datasets[:5]:  # Show first 5 datasets
+            for dataset in datasets[:DATASETS_SHOWN]:
                 print(f"  • {dataset.dataset_id}")
-            if len(datasets) > 5:
-                print(f"  ... and {len(datasets) - 5} more")
+            if len(datasets) > DATASETS_SHOWN:
+                print("  ... and more")
         else:
             print("No datasets found in this project.")
 
@@ -55,8 +59,8 @@ def test_connection(config):
         print(f"{'Word':<15} {'Count':<8} Corpus")
         print("-" * 40)
         
-        for _, row in results_df.iterrows():
-            print(f"{row['word']:<15} {row['word_count']:<8} {row['corpus']}")
+        for row in results_df.itertuples(index=False):
+            print(f"{row.word:<15} {row.word_count:<8} {row.corpus}")
         
         print(f"\n✓ BigQuery connection and query test completed successfully!")
         return True
@@ -5,14 +5,16 @@ Executes all SQL schema files with option to drop existing tables.
 """
 import os
 import sys
-import glob
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from google.cloud import bigquery
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / "lib"))
-from bigquery_helpers import get_standard_args, execute_query
+from bigquery_helpers import get_standard_args, execute_query, wait_for_job, get_client
 
+# Schema files are read concurrently so slow (network) filesystems don't serialize the reads
+SCHEMA_READ_WORKERS = 8
 
 
 def create_dataset_if_not_exists(client, config):
@@ -38,8 +40,10 @@ def get_schema_files():
     if not schemas_dir.exists():
         raise FileNotFoundError(f"Schemas directory not found: {schemas_dir}")
     
-    # Find all .sql files in schemas directory
-    sql_files = list(schemas_dir.glob("*.sql"))
+    # Find all .sql files in schemas directory (scandir reuses the directory entry types)
+    with os.scandir(schemas_dir) as entries:
+        sql_files = [Path(entry.path) for entry in entries
+                     if entry.name.endswith('.sql') and entry.is_file(follow_symlinks=False)]
     
     if not sql_files:
         raise FileNotFoundError(f"No SQL files found in {schemas_dir}")
@@ -54,77 +58,46 @@ def get_schema_files():
     return sql_files
 
 
-def drop_table_if_exists(client, config, table_name, drop_tables):
-    """Drop table if it exists and drop_tables is True."""
-    if not drop_tables:
-        return
+def prepare_schema_sql(config, file_path):
+    """Read a schema SQL file with parameter substitution; returns (table_name, sql).
     
-    table_id = f"{config.project_id}.{config.dataset_id}.{table_name}"
+    Each schema file creates the table it is named after (schemas/<table_name>.sql).
+    """
+    sql_content = file_path.read_text()
     
-    try:
-        client.get_table(table_id)
-        # Table exists, drop it
-        client.delete_table(table_id)
-        print(f"  ✓ Dropped {table_name}")
-    except Exception:
-        # Table doesn't exist, nothing to drop
-        pass
+    # Substitute parameters (plain replace, so other braces in the DDL are left alone)
+    sql_content = sql_content.replace('{PROJECT_ID}', config.project_id).replace('{DATASET_ID}', config.dataset_id)
+    
+    return file_path.stem, sql_content
 
 
-def extract_table_name_from_sql(sql_content):
-    """Extract table name from CREATE TABLE statement (after parameter substitution)."""
-    import re
-    
-    # Look for pattern: CREATE TABLE IF NOT EXISTS `project.dataset.table_name`
-    pattern = r'CREATE TABLE IF NOT EXISTS `[^.]+\.[^.]+\.([^`]+)`'
-    match = re.search(pattern, sql_content, re.IGNORECASE)
-    
-    if match:
-        return match.group(1)
-    
-    # Fallback pattern without backticks
-    pattern = r'CREATE TABLE IF NOT EXISTS\s+\w+\.\w+\.(\w+)'
-    match = re.search(pattern, sql_content, re.IGNORECASE)
+def build_schema_script(config, schema_sqls, drop_tables=False):
+    """Combine all schema DDL (and optional drops) into one BigQuery multi-statement script."""
+    statements = []
     
-    if match:
-        return match.group(1)
+    if drop_tables:
+        for table_name, _ in schema_sqls:
+            statements.append(f"DROP TABLE IF EXISTS `{config.project_id}.{config.dataset_id}.{table_name}`")
     
-    return None
+    statements.extend(sql.strip().rstrip(';') for _, sql in schema_sqls)
+    return ";\n\n".join(statements) + ";"
 
 
-def execute_schema_file(client, config, file_path, drop_tables=False):
-    """Execute a single schema SQL file with parameter substitution."""
-    print(f"\nProcessing {file_path.name}...")
+def execute_schema_files(client, config, schema_files, drop_tables=False):
+    """Create all schemas with a single script job instead of one job per file."""
+    with ThreadPoolExecutor(max_workers=SCHEMA_READ_WORKERS) as executor:
+        schema_sqls = list(executor.map(lambda file_path: prepare_schema_sql(config, file_path), schema_files))
+    script = build_schema_script(config, schema_sqls, drop_tables)
     
-    # Read SQL file
-    with open(file_path, 'r') as f:
-        sql_content = f.read()
-    
-    # Substitute parameters
-    sql_content = sql_content.format(
-        PROJECT_ID=config.project_id,
-        DATASET_ID=config.dataset_id
-    )
-    
-    # Extract table name for potential dropping
-    table_name = extract_table_name_from_sql(sql_content)
-    
-    if table_name and drop_tables:
-        drop_table_if_exists(client, config, table_name, drop_tables)
-    
-    # Execute the CREATE TABLE statement
+    print(f"\nExecuting {len(schema_sqls)} schema files as one script{' (with drops)' if drop_tables else ''}...")
     try:
-        query_job = client.query(sql_content)
-        query_job.result()  # Wait for completion
-        
-        if table_name:
-            print(f"  ✓ Created {table_name}")
-        else:
-            print(f"  ✓ Executed {file_path.name}")
-            
+        wait_for_job(client.query(script))
     except Exception as e:
-        print(f"  ✗ Error executing {file_path.name}: {e}")
+        print(f"  ✗ Error executing schema script: {e}")
         raise
+    
+    for table_name, _ in schema_sqls:
+        print(f"  ✓ {'Recreated' if drop_tables else 'Created'} {table_name}")
 
 
 def get_args():
@@ -168,7 +141,7 @@ def main():
         print()
         
         # Initialize BigQuery client
-        client = bigquery.Client(project=config.project_id)
+        client = get_client(config.project_id)
         
         # Create dataset if needed
         create_dataset_if_not_exists(client, config)
@@ -176,9 +149,8 @@ def main():
         # Get all schema files
         schema_files = get_schema_files()
         
-        # Execute each schema file
-        for file_path in schema_files:
-            execute_schema_file(client, config, file_path, drop_tables)
+        # Execute all schema files in one script job
+        execute_schema_files(client, config, schema_files, drop_tables)
         
         print(f"✓ Created {len(schema_files)} schemas successfully")
         
@@ -6,26 +6,38 @@ Creates crisis events with contrarian buy windows.
 import os
 import sys
 from pathlib import Path
-from google.cloud import bigquery
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import date, datetime
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / "lib"))
-from bigquery_helpers import get_standard_args, load_to_bigquery_table
+from bigquery_helpers import get_standard_args, get_client, load_to_bigquery_table
 
+# pandas, numpy and google.cloud.bigquery are imported where used, so --help and
+# argument errors return without loading them
 
 
-def create_dataset_if_not_exists(config):
+# Popular tokens with guaranteed pools, renamed as crisis tokens for mock data
+CrisisToken = namedtuple('CrisisToken', ['token_address', 'crisis_name', 'crisis_date'])
+CRISIS_TOKENS = (
+    CrisisToken("0x1f9840a85d5af5bf1d1762f925bdaddc4201f984", "CRISIS1 Token Market Manipulation", date(2022, 3, 15)),  # UNI -> CRISIS1
+    CrisisToken("0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0", "CRISIS2 Token Governance Exploit", date(2022, 5, 15)),  # MATIC -> CRISIS2
+    CrisisToken("0x514910771af9ca656af840dff83e8264ecf986ca", "CRISIS3 Token Flash Loan Attack", date(2022, 1, 10)),  # LINK -> CRISIS3
+    CrisisToken("0xa0b73e1ff0b80914ab6fe0444e65848c4c34450b", "CRISIS4 Token Exchange Delisting", date(2021, 5, 19)),  # CRO -> CRISIS4
+    CrisisToken("0x2260fac5e5542a773aa44fbcfedf7c193bc2c599", "CRISIS5 Token Bridge Vulnerability", date(2021, 12, 1)),  # WBTC -> CRISIS5
+    CrisisToken("0x95ad61b0a150d79219dcf64e1e6cc01f0b64c4ce", "CRISIS6 Token Whale Dumping Event", date(2022, 11, 9)),  # SHIB -> CRISIS6
+)
+
+
+def create_dataset_if_not_exists(client, config):
     """Create the dataset if it doesn't exist."""
-    client = bigquery.Client(project=config.project_id)
     dataset_id = f"{config.project_id}.{config.dataset_id}"
     
     try:
         dataset = client.get_dataset(dataset_id)
         print(f"✓ Dataset {dataset_id} already exists")
     except Exception:
+        from google.cloud import bigquery
         dataset = bigquery.Dataset(dataset_id)
         dataset.location = "US"
         dataset = client.create_dataset(dataset, exists_ok=True)
@@ -34,90 +46,44 @@ def create_dataset_if_not_exists(config):
 
 def generate_crisis_events(count=6):
     """Generate crisis events based on real historical data."""
-    np.random.seed(42)
+    import numpy as np
+    import pandas as pd
+    
+    rng = np.random.default_rng(42)
+    
+    # Real crises first; if more are requested, additional mock crises on randomly chosen tokens
+    real_crises = CRISIS_TOKENS[:count]
+    extra_count = max(count - len(CRISIS_TOKENS), 0)
+    base_index = rng.integers(0, len(CRISIS_TOKENS), size=extra_count)
     
-    # Popular tokens with guaranteed pools, renamed as crisis tokens for mock data
-    crisis_tokens = [
-        {
-            "token_address": "0x1f9840a85d5af5bf1d1762f925bdaddc4201f984",  # UNI -> CRISIS1
-            "crisis_name": "CRISIS1 Token Market Manipulation",
-            "crisis_date": datetime(2022, 3, 15).date(),
-        },
-        {
-            "token_address": "0x7d1afa7b718fb893db30a3abc0cfc608aacfebb0",  # MATIC -> CRISIS2
-            "crisis_name": "CRISIS2 Token Governance Exploit",
-            "crisis_date": datetime(2022, 5, 15).date(),
-        },
-        {
-            "token_address": "0x514910771af9ca656af840dff83e8264ecf986ca",  # LINK -> CRISIS3
-            "crisis_name": "CRISIS3 Token Flash Loan Attack", 
-            "crisis_date": datetime(2022, 1, 10).date(),
-        },
-        {
-            "token_address": "0xa0b73e1ff0b80914ab6fe0444e65848c4c34450b",  # CRO -> CRISIS4
-            "crisis_name": "CRISIS4 Token Exchange Delisting",
-            "crisis_date": datetime(2021, 5, 19).date(),
-        },
-        {
-            "token_address": "0x2260fac5e5542a773aa44fbcfedf7c193bc2c599",  # WBTC -> CRISIS5
-            "crisis_name": "CRISIS5 Token Bridge Vulnerability",
-            "crisis_date": datetime(2021, 12, 1).date(),
-        },
-        {
-            "token_address": "0x95ad61b0a150d79219dcf64e1e6cc01f0b64c4ce",  # SHIB -> CRISIS6
-            "crisis_name": "CRISIS6 Token Whale Dumping Event",
-            "crisis_date": datetime(2022, 11, 9).date(),
-        }
+    token_addresses = [c.token_address for c in real_crises] + [CRISIS_TOKENS[j].token_address for j in base_index]
+    crisis_names = [c.crisis_name for c in real_crises] + [
+        f"Additional Crisis Event {i+1}" for i in range(len(CRISIS_TOKENS), count)
     ]
     
-    data = []
-    for i, crisis in enumerate(crisis_tokens[:count]):
-        crisis_id = f"crisis_{i+1:03d}"
-        
-        # Simple random buy window (3-14 days)
-        window_days = np.random.randint(3, 15)
-        window_start = crisis['crisis_date']
-        window_end = crisis['crisis_date'] + timedelta(days=window_days)
-        
-        data.append({
-            "crisis_id": crisis_id,
-            "token_address": crisis["token_address"],
-            "crisis_date": crisis["crisis_date"],
-            "crisis_name": crisis["crisis_name"],
-            "window_start_date": window_start,
-            "window_end_date": window_end,
-            "dt": crisis['crisis_date']
-        })
+    # Additional crises fall 60-400 days before today; date math stays in datetime64[D]
+    today = np.datetime64(datetime.now().date(), 'D')
+    days_ago = rng.integers(60, 400, size=extra_count)
+    crisis_dates = np.concatenate([
+        np.array([c.crisis_date for c in real_crises], dtype='datetime64[D]'),
+        today - days_ago.astype('timedelta64[D]'),
+    ])
     
-    # If more crises requested than available tokens, generate additional mock ones
-    if count > len(crisis_tokens):
-        for i in range(len(crisis_tokens), count):
-            # Pick a random token from existing ones
-            base_crisis = np.random.choice(crisis_tokens)
-            token_addr = base_crisis["token_address"]
-            
-            # Generate additional crisis in different time period
-            days_ago = np.random.randint(60, 400)
-            crisis_date = (datetime.now() - timedelta(days=days_ago)).date()
-            
-            crisis_id = f"crisis_{i+1:03d}"
-            
-            # Simple random window
-            window_days = np.random.randint(3, 15)
-            window_start = crisis_date
-            window_end = crisis_date + timedelta(days=window_days)
-            
-            data.append({
-                "crisis_id": crisis_id,
-                "token_address": token_addr,
-                "crisis_date": crisis_date,
-                "crisis_name": f"Additional Crisis Event {i+1}",
-                "window_start_date": window_start,
-                "window_end_date": window_end,
-                "dt": crisis_date
-            })
+    # Simple random buy window (3-14 days)
+    window_days = rng.integers(3, 15, size=count)
+    window_end_dates = crisis_dates + window_days.astype('timedelta64[D]')
     
-    return pd.DataFrame(data)
+    # Back to datetime.date values so the columns still load as BigQuery DATE
+    crisis_dates = crisis_dates.astype(object)
+    return pd.DataFrame({
+        "crisis_id": [f"crisis_{i+1:03d}" for i in range(count)],
+        "token_address": token_addresses,
+        "crisis_date": crisis_dates,
+        "crisis_name": crisis_names,
+        "window_start_date": crisis_dates,
+        "window_end_date": window_end_dates.astype(object),
+        "dt": crisis_dates,
+    })
 
 
 def get_args():
@@ -161,14 +127,17 @@ def main():
         print(f"Crisis events to generate: {count}")
         print()
         
+        # One client for the dataset check and the load
+        client = get_client(config.project_id)
+        
         # Create dataset
-        create_dataset_if_not_exists(config)
+        create_dataset_if_not_exists(client, config)
         
         # Generate crisis events data
         df_crisis = generate_crisis_events(count=count)
         
         # No schema needed since CREATE_IF_NEEDED is used
-        load_to_bigquery_table(df_crisis, config, "crisis_events_with_window", schema=None)
+        load_to_bigquery_table(df_crisis, config, "crisis_events_with_window", schema=None, client=client)
         
         print(f"✓ Crisis events generation complete: {len(df_crisis)} events")
         
@@ -13,12 +13,12 @@ from datetime import datetime, timedelta
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / "lib"))
-from bigquery_helpers import get_standard_args, BigQueryConfig, load_to_bigquery_table, execute_query
+from bigquery_helpers import get_standard_args, BigQueryConfig, get_client, load_to_bigquery_table, execute_query
 
 
 def create_dataset_if_not_exists(config):
     """Create the dataset if it doesn't exist."""
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     dataset_id = f"{config.project_id}.{config.dataset_id}"
     
     try:
@@ -36,7 +36,7 @@ def generate_token_price_history(config):
     np.random.seed(42)
     
     # First, get the crisis events from BigQuery to align price data
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     crisis_query = f"""
         SELECT token_address, crisis_date, window_start_date, window_end_date
         FROM `{config.project_id}.{config.dataset_id}.crisis_events_with_window`
@@ -70,31 +70,39 @@ def generate_token_price_history(config):
             "volume_base": np.random.choice(base_volumes)
         }
     
-    all_price_data = []
+    # Generate price data from 2020 to today, one row per token per day
+    start_date = datetime(2020, 1, 1).date()
+    end_date = datetime.now().date()
+    n_days = (end_date - start_date).days + 1
+    dates = np.array([start_date + timedelta(days=i) for i in range(n_days)], dtype=object)
     
-    # Get unique tokens from crisis events
-    unique_tokens = crisis_df['token_address'].unique()
+    # Preallocate output columns for every token-day and fill them by index
+    n_rows = len(unique_tokens) * n_days
+    price_usd = np.empty(n_rows)
+    volume_24h_usd = np.empty(n_rows)
+    market_cap_usd = np.empty(n_rows)
+    price_change_24h_pct = np.empty(n_rows)
+    liquidity_usd = np.empty(n_rows)
+    high_24h_usd = np.empty(n_rows)
+    low_24h_usd = np.empty(n_rows)
     
-    for token_address in unique_tokens:
-        if token_address not in token_info:
-            continue
-            
+    # Group crisis events by token once instead of re-filtering crisis_df per token
+    crises_by_token = {token: group for token, group in crisis_df.groupby('token_address', sort=False)}
+    
+    for t, token_address in enumerate(unique_tokens):
         info = token_info[token_address]
-        token_crises = crisis_df[crisis_df['token_address'] == token_address]
-        
-        # Generate 2 years of price data
-        start_date = datetime(2020, 1, 1).date()
-        end_date = datetime.now().date()
-        current_date = start_date
+        crisis_dates = crises_by_token[token_address]['crisis_date'].tolist()
         current_price = info["base_price"]
         
-        while current_date <= end_date:
+        for d, current_date in enumerate(dates):
+            row = t * n_days + d
+            
             # Check if we're near any crisis
             near_crisis = False
             crisis_intensity = 0.0
             
-            for _, crisis in token_crises.iterrows():
-                days_to_crisis = (crisis['crisis_date'] - current_date).days
+            for crisis_date in crisis_dates:
+                days_to_crisis = (crisis_date - current_date).days
                 
                 # Crisis surge (big drop) around crisis date
                 if abs(days_to_crisis) <= 7:
@@ -118,30 +126,28 @@ def generate_token_price_history(config):
             new_price = max(new_price, 0.01)  # Price floor
             
             # Simple market data
-            price_change_pct = daily_change * 100
-            volume_24h = info["volume_base"] * (1 + abs(daily_change) * 3) * np.random.uniform(0.5, 2.0)
-            market_cap = new_price * np.random.uniform(100000000, 1000000000)
-            liquidity = volume_24h * np.random.uniform(0.1, 0.5)
-            
-            high_24h = new_price * np.random.uniform(1.01, 1.05)
-            low_24h = new_price * np.random.uniform(0.95, 0.99)
+            price_usd[row] = new_price
+            price_change_24h_pct[row] = daily_change * 100
+            volume_24h_usd[row] = info["volume_base"] * (1 + abs(daily_change) * 3) * np.random.uniform(0.5, 2.0)
+            market_cap_usd[row] = new_price * np.random.uniform(100000000, 1000000000)
+            liquidity_usd[row] = volume_24h_usd[row] * np.random.uniform(0.1, 0.5)
             
-            all_price_data.append({
-                "token_address": token_address,
-                "price_usd": round(new_price, 6),
-                "volume_24h_usd": round(volume_24h, 2),
-                "market_cap_usd": round(market_cap, 2),
-                "price_change_24h_pct": round(price_change_pct, 2),
-                "liquidity_usd": round(liquidity, 2),
-                "high_24h_usd": round(high_24h, 6),
-                "low_24h_usd": round(low_24h, 6),
-                "dt": current_date
-            })
+            high_24h_usd[row] = new_price * np.random.uniform(1.01, 1.05)
+            low_24h_usd[row] = new_price * np.random.uniform(0.95, 0.99)
             
             current_price = new_price
-            current_date += timedelta(days=1)
     
-    return pd.DataFrame(all_price_data)
+    return pd.DataFrame({
+        "token_address": np.repeat(np.asarray(unique_tokens, dtype=object), n_days),
+        "price_usd": price_usd.round(6),
+        "volume_24h_usd": volume_24h_usd.round(2),
+        "market_cap_usd": market_cap_usd.round(2),
+        "price_change_24h_pct": price_change_24h_pct.round(2),
+        "liquidity_usd": liquidity_usd.round(2),
+        "high_24h_usd": high_24h_usd.round(6),
+        "low_24h_usd": low_24h_usd.round(6),
+        "dt": np.tile(dates, len(unique_tokens))
+    })
 
 
 
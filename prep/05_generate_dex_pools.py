@@ -12,12 +12,12 @@ import numpy as np
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / "lib"))
-from bigquery_helpers import get_standard_args, BigQueryConfig, execute_query, load_to_bigquery_table, create_query_with_udfs, ETHEREUM_CONSTANTS
+from bigquery_helpers import get_standard_args, BigQueryConfig, get_client, execute_query, load_to_bigquery_table, create_query_with_udfs, ETHEREUM_CONSTANTS
 
 
 def create_dataset_if_not_exists(config):
     """Create the dataset if it doesn't exist."""
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     dataset_id = f"{config.project_id}.{config.dataset_id}"
     
     try:
@@ -37,7 +37,7 @@ def generate_dim_dex_pools(config):
     # First, get the crisis tokens from the crisis_events_with_window table
     print("🔍 Reading crisis tokens from crisis_events_with_window table...")
     
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     crisis_query = f"""
         SELECT DISTINCT LOWER(token_address) as token_address
         FROM `{config.project_id}.{config.dataset_id}.crisis_events_with_window`
@@ -71,11 +71,13 @@ def generate_dim_dex_pools(config):
     token_symbols.update(BASE_TOKEN_SYMBOLS)
     
     print(f"🔍 Querying Uniswap V2 pools for {len(crisis_tokens)} crisis tokens...")
-    client = bigquery.Client()
+    client = get_client()
     
-    # Create SQL arrays for token filtering
-    crisis_tokens_sql = "', '".join([t.lower() for t in crisis_tokens])
-    base_tokens_sql = "', '".join([t.lower() for t in base_tokens])
+    # Token lists are passed as array parameters rather than interpolated into the SQL text
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter('crisis_tokens', 'STRING', [t.lower() for t in crisis_tokens]),
+        bigquery.ArrayQueryParameter('base_tokens', 'STRING', [t.lower() for t in base_tokens]),
+    ])
     
     # Create query with UDFs using helper function
     main_query = f"""
@@ -92,61 +94,48 @@ def generate_dim_dex_pools(config):
       AND topics[SAFE_OFFSET(0)] = '{V2_PAIR_CREATED_TOPIC}'  -- V2 PairCreated
       AND block_timestamp >= '2020-01-01'
       AND (
-        (EXTRACT_TOKEN_ADDRESS(topics, 1) IN ('{crisis_tokens_sql}') 
-         AND EXTRACT_TOKEN_ADDRESS(topics, 2) IN ('{base_tokens_sql}'))
+        (EXTRACT_TOKEN_ADDRESS(topics, 1) IN UNNEST(@crisis_tokens) 
+         AND EXTRACT_TOKEN_ADDRESS(topics, 2) IN UNNEST(@base_tokens))
         OR 
-        (EXTRACT_TOKEN_ADDRESS(topics, 1) IN ('{base_tokens_sql}')
-         AND EXTRACT_TOKEN_ADDRESS(topics, 2) IN ('{crisis_tokens_sql}'))
+        (EXTRACT_TOKEN_ADDRESS(topics, 1) IN UNNEST(@base_tokens)
+         AND EXTRACT_TOKEN_ADDRESS(topics, 2) IN UNNEST(@crisis_tokens))
       )
-    ORDER BY block_timestamp DESC
     """
     
     # Combine UDFs with main query
     query = create_query_with_udfs(main_query)
     
     try:
-        real_pools_df = execute_query(client, query, "DEX pools from Ethereum logs")
+        real_pools_df = execute_query(client, query, "DEX pools from Ethereum logs", job_config)
         
         if len(real_pools_df) == 0:
             print("❌ No DEX pools found for crisis tokens")
             raise Exception("No real DEX pools found for crisis tokens")
         
-        # Convert to our format - ONLY real pools
-        data = []
-        for _, row in real_pools_df.iterrows():
-            # Addresses are already lowercase from query
-            token0_addr = str(row['token0_address']) 
-            token1_addr = str(row['token1_address'])
-            pool_addr = str(row['pool_address'])
-            
+        # Convert to our format - ONLY real pools (addresses are already lowercase from query)
+        addresses = {}
+        for col in ['token0_address', 'token1_address', 'pool_address']:
+            addr = real_pools_df[col].astype(str)
             # Ensure 0x prefix
-            if not token0_addr.startswith('0x'):
-                token0_addr = '0x' + token0_addr
-            if not token1_addr.startswith('0x'):
-                token1_addr = '0x' + token1_addr
-            if not pool_addr.startswith('0x'):
-                pool_addr = '0x' + pool_addr
-                
-            # Skip if addresses are invalid length
-            if len(token0_addr) != 42 or len(token1_addr) != 42 or len(pool_addr) != 42:
-                continue
-                
-            # Get symbols (addresses are already lowercase)
-            token0_symbol = token_symbols.get(token0_addr, "UNK")
-            token1_symbol = token_symbols.get(token1_addr, "UNK")
-            
-            data.append({
-                "pool_address": pool_addr,
-                "pool_name": f"{token0_symbol}-{token1_symbol} Pool",
-                "token0_address": token0_addr,
-                "token0_symbol": token0_symbol,
-                "token1_address": token1_addr, 
-                "token1_symbol": token1_symbol,
-                "dex_protocol": str(row['dex_protocol']),
-                "chain": "ethereum"
-            })
+            addresses[col] = addr.where(addr.str.startswith('0x'), '0x' + addr)
         
-        result_df = pd.DataFrame(data)
+        # Skip rows with invalid address lengths
+        valid = np.logical_and.reduce([addr.str.len() == 42 for addr in addresses.values()])
+        token0_addr = addresses['token0_address'][valid]
+        token1_addr = addresses['token1_address'][valid]
+        token0_symbol = token0_addr.map(token_symbols).fillna("UNK")
+        token1_symbol = token1_addr.map(token_symbols).fillna("UNK")
+        
+        result_df = pd.DataFrame({
+            "pool_address": addresses['pool_address'][valid].to_numpy(),
+            "pool_name": (token0_symbol + "-" + token1_symbol + " Pool").to_numpy(),
+            "token0_address": token0_addr.to_numpy(),
+            "token0_symbol": token0_symbol.to_numpy(),
+            "token1_address": token1_addr.to_numpy(),
+            "token1_symbol": token1_symbol.to_numpy(),
+            "dex_protocol": real_pools_df['dex_protocol'][valid].astype(str).to_numpy(),
+            "chain": "ethereum"
+        })
         print(f"✅ Found {len(result_df)} real DEX pools")
         return result_df
         
@@ -160,7 +149,7 @@ def load_to_bigquery(df, config, table_name):
     if len(df) == 0:
         raise Exception(f"No data generated for table {table_name}")
     
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     table_id = f"{config.project_id}.{config.dataset_id}.{table_name}"
     
     job_config = bigquery.LoadJobConfig(
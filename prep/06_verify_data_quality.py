@@ -10,14 +10,14 @@ import pandas as pd
 
 # Add lib directory to path for imports
 sys.path.append(str(Path(__file__).parent.parent / "lib"))
-from bigquery_helpers import get_standard_args, BigQueryConfig, execute_query
+from bigquery_helpers import get_standard_args, BigQueryConfig, get_client, execute_query
 
 
 def verify_crisis_price_join(config):
     """Verify that crisis events can join with price data and show realistic patterns."""
     print("\n🔍 Testing Crisis Events ↔ Price History Join...")
     
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     
     # Query to join crisis events with price data and analyze price movements
     query = f"""
@@ -79,19 +79,19 @@ def verify_crisis_price_join(config):
         print(f"✅ Found {len(results_df)} crisis events with complete price data")
         
         success = True
-        for _, row in results_df.iterrows():
-            print(f"\n📊 Crisis Analysis: {row['crisis_id']}")
-            print(f"   Token: {row['token_address'][:10]}...")
-            print(f"   Crisis Date: {row['crisis_date']}")
-            print(f"   Price Before: ${row['price_before_crisis']:.4f}")
-            print(f"   Price During Crisis: ${row['price_during_crisis']:.4f}")
-            print(f"   Price After Recovery: ${row['price_after_recovery']:.4f}")
-            print(f"   📉 Crisis Drop: {row['crisis_drop_pct']}%")
-            print(f"   📈 Recovery Gain: {row['recovery_gain_pct']}%")
+        for row in results_df.itertuples(index=False):
+            print(f"\n📊 Crisis Analysis: {row.crisis_id}")
+            print(f"   Token: {row.token_address[:10]}...")
+            print(f"   Crisis Date: {row.crisis_date}")
+            print(f"   Price Before: ${row.price_before_crisis:.4f}")
+            print(f"   Price During Crisis: ${row.price_during_crisis:.4f}")
+            print(f"   Price After Recovery: ${row.price_after_recovery:.4f}")
+            print(f"   📉 Crisis Drop: {row.crisis_drop_pct}%")
+            print(f"   📈 Recovery Gain: {row.recovery_gain_pct}%")
             
             # Validate realistic price movements
-            if row['crisis_drop_pct'] > -5:  # Should show some drop during crisis
-                print(f"   ⚠️  Warning: Crisis drop only {row['crisis_drop_pct']}% (expected more negative)")
+            if row.crisis_drop_pct > -5:  # Should show some drop during crisis
+                print(f"   ⚠️  Warning: Crisis drop only {row.crisis_drop_pct}% (expected more negative)")
                 success = False
             else:
                 print("   ✅ Realistic crisis price drop detected")
@@ -107,7 +107,7 @@ def verify_dex_pools_ethereum_logs(config):
     """Verify that generated DEX pool addresses exist in public Ethereum logs."""
     print("\n🔍 Testing DEX Pools ↔ Ethereum Logs Join...")
     
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     
     # Get all pool addresses from our generated data
     pools_query = f"""
@@ -125,9 +125,10 @@ def verify_dex_pools_ethereum_logs(config):
             
         print(f"📋 Testing {len(pools_df)} DEX pool addresses...")
         
-        # Create IN clause with all pool addresses
-        pool_addresses = [f"'{addr}'" for addr in pools_df['pool_address'].tolist()]
-        addresses_in_clause = "(" + ", ".join(pool_addresses) + ")"
+        # Pass all pool addresses as one array parameter instead of an inline IN list
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter('pools', 'STRING', pools_df['pool_address'].tolist()),
+        ])
         
         # Single query to check ALL pool addresses at once
         logs_query = f"""
@@ -137,14 +138,14 @@ def verify_dex_pools_ethereum_logs(config):
           MIN(block_timestamp) as first_seen,
           MAX(block_timestamp) as last_seen
         FROM `bigquery-public-data.crypto_ethereum.logs`
-        WHERE address IN {addresses_in_clause}
+        WHERE address IN UNNEST(@pools)
           AND block_timestamp >= '2020-01-01'
         GROUP BY address
         ORDER BY transaction_count DESC
         """
         
         print("🔍 Querying Ethereum logs for all pool addresses...")
-        logs_df = execute_query(client, logs_query, "Ethereum logs verification")
+        logs_df = execute_query(client, logs_query, "Ethereum logs verification", job_config)
         
         # Join results with our pool data
         results_df = pools_df.merge(
@@ -162,18 +163,18 @@ def verify_dex_pools_ethereum_logs(config):
         
         if len(real_pools) > 0:
             print(f"\n✅ Found {len(real_pools)} REAL pools with Ethereum transactions:")
-            for _, pool in real_pools.iterrows():
-                first_seen = pool['first_seen'].date() if pd.notna(pool['first_seen']) else 'Unknown'
-                last_seen = pool['last_seen'].date() if pd.notna(pool['last_seen']) else 'Unknown'
-                print(f"   🏊 {pool['pool_name']} ({pool['dex_protocol']})")
-                print(f"      📍 {pool['pool_address']}")
-                print(f"      📊 {int(pool['transaction_count']):,} transactions ({first_seen} → {last_seen})")
+            for pool in real_pools.itertuples(index=False):
+                first_seen = pool.first_seen.date() if pd.notna(pool.first_seen) else 'Unknown'
+                last_seen = pool.last_seen.date() if pd.notna(pool.last_seen) else 'Unknown'
+                print(f"   🏊 {pool.pool_name} ({pool.dex_protocol})")
+                print(f"      📍 {pool.pool_address}")
+                print(f"      📊 {int(pool.transaction_count):,} transactions ({first_seen} → {last_seen})")
         
         if len(mock_pools) > 0:
             print(f"\n📦 Found {len(mock_pools)} MOCK pools (no Ethereum transactions):")
-            for _, pool in mock_pools.head(5).iterrows():  # Show first 5 mock pools
-                print(f"   📦 {pool['pool_name']} ({pool['dex_protocol']})")
-                print(f"      📍 {pool['pool_address']}")
+            for pool in mock_pools.head(5).itertuples(index=False):  # Show first 5 mock pools
+                print(f"   📦 {pool.pool_name} ({pool.dex_protocol})")
+                print(f"      📍 {pool.pool_address}")
             
             if len(mock_pools) > 5:
                 print(f"      ... and {len(mock_pools) - 5} more mock pools")
@@ -199,7 +200,7 @@ def verify_data_completeness(config):
     """Verify that all expected tables exist and have data."""
     print("\n🔍 Testing Data Completeness...")
     
-    client = bigquery.Client(project=config.project_id)
+    client = get_client(config.project_id)
     
     expected_tables = [
         'crisis_events_with_window',
@@ -11,6 +11,7 @@ CREATE TABLE IF NOT EXISTS `{PROJECT_ID}.{DATASET_ID}.stg_crisis_buyers` (
   total_usd_spent FLOAT64 OPTIONS(description="Total USD value spent buying tokens during crisis window"),
   num_transactions INT64 OPTIONS(description="Number of separate buy transactions during the crisis window")
 )
+CLUSTER BY token_address
 OPTIONS (
   description = "Wallets that purchased tokens during identified crisis windows"
 );
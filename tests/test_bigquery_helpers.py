@@ -0,0 +1,103 @@
+"""Tests for lib/bigquery_helpers.py (run with: python -m unittest discover tests)"""
+
+import sys
+import types
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(str(Path(__file__).parent.parent / "lib"))
+
+from bigquery_helpers import BigQueryConfig, load_to_bigquery_table
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeLoadJobConfig:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def fake_google_modules():
+    """Minimal google.cloud.bigquery / google.api_core.exceptions stand-ins for sys.modules"""
+    bigquery = types.ModuleType('google.cloud.bigquery')
+    bigquery.LoadJobConfig = FakeLoadJobConfig
+    bigquery.WriteDisposition = SimpleNamespace(WRITE_TRUNCATE='WRITE_TRUNCATE', WRITE_APPEND='WRITE_APPEND')
+    bigquery.SourceFormat = SimpleNamespace(PARQUET='PARQUET')
+    exceptions = types.ModuleType('google.api_core.exceptions')
+    exceptions.NotFound = NotFound
+    google = types.ModuleType('google')
+    google.cloud = types.ModuleType('google.cloud')
+    google.cloud.bigquery = bigquery
+    google.api_core = types.ModuleType('google.api_core')
+    google.api_core.exceptions = exceptions
+    return {
+        'google': google,
+        'google.cloud': google.cloud,
+        'google.cloud.bigquery': bigquery,
+        'google.api_core': google.api_core,
+        'google.api_core.exceptions': exceptions,
+    }
+
+
+class FakeClient:
+    def __init__(self, table_schema=None):
+        self.table_schema = table_schema
+        self.loads = []
+
+    def get_table(self, table_id):
+        if self.table_schema is None:
+            raise NotFound(table_id)
+        return SimpleNamespace(schema=self.table_schema)
+
+    def load_table_from_file(self, buffer, table_id, job_config=None):
+        self.loads.append((pq.read_table(buffer), table_id, job_config))
+        return SimpleNamespace(done=lambda: True, result=lambda: None)
+
+
+class LoadWithoutSchemaTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(sys.modules, fake_google_modules())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.config = BigQueryConfig('proj', 'ds')
+        self.df = pd.DataFrame({
+            'pool_address': ['0xa', '0xb'],
+            'pool_name': ['A/B', None],
+        })
+
+    def test_schema_none_uses_existing_table_schema(self):
+        table_schema = [
+            SimpleNamespace(name='pool_address', field_type='STRING', mode='REQUIRED'),
+            SimpleNamespace(name='pool_name', field_type='STRING', mode='NULLABLE'),
+        ]
+        client = FakeClient(table_schema)
+
+        load_to_bigquery_table(self.df, self.config, 'pools', schema=None, client=client)
+
+        [(table, table_id, job_config)] = client.loads
+        self.assertEqual(table_id, 'proj.ds.pools')
+        self.assertIs(job_config.schema, table_schema)
+        self.assertEqual(table.schema.field('pool_address').type, pa.string())
+        self.assertFalse(table.schema.field('pool_address').nullable)
+        self.assertTrue(table.schema.field('pool_name').nullable)
+
+    def test_schema_none_infers_when_table_missing(self):
+        client = FakeClient()
+
+        load_to_bigquery_table(self.df, self.config, 'pools', schema=None, client=client)
+
+        [(table, _, job_config)] = client.loads
+        self.assertIsNone(job_config.schema)
+        self.assertEqual(table.column_names, ['pool_address', 'pool_name'])
+
+
+if __name__ == '__main__':
+    unittest.main()